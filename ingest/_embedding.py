@@ -0,0 +1,168 @@
+"""
+Single-text embedding calls to the SageMaker endpoint, shared by the search
+Lambda and the scripts.
+
+get_embedding retries transient errors with full-jitter backoff, fails fast
+through a circuit breaker while the endpoint is down, and caches results per
+process (i.e. per warm Lambda container).
+"""
+
+import functools
+import os
+import random
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+from _hf_output import dumps, extract_embedding, loads
+
+# SageMaker retries: attempts in total, and full-jitter backoff of
+# uniform(0, min(cap, base * 2**attempt)) seconds between them
+EMBED_RETRY_ATTEMPTS = int(os.environ.get('EMBED_RETRY_ATTEMPTS', 3))
+EMBED_RETRY_BASE_SECS = float(os.environ.get('EMBED_RETRY_BASE_SECS', 0.5))
+EMBED_RETRY_CAP_SECS = float(os.environ.get('EMBED_RETRY_CAP_SECS', 8))
+
+# Module scope, so warm invocations reuse the pooled keep-alive connections.
+# get_embedding retries throttling, 5xx and connection/timeout errors itself,
+# so botocore's retries are turned off to avoid stacking two backoffs.
+sagemaker_runtime = boto3.client('sagemaker-runtime', config=Config(
+    max_pool_connections=20,
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=30,
+    retries={'mode': 'standard', 'max_attempts': 0},
+))
+
+
+# Error codes that mean the endpoint, not the request, is in trouble
+_UNHEALTHY_CODES = {
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'ServiceUnavailable',
+    'InternalFailure',
+    'InternalServerError',
+    'ModelNotReadyException',
+}
+
+
+def _is_unhealthy(error):
+    """True for throttling, 5xx and connection/timeout errors.
+
+    Those are worth retrying and count toward the circuit breaker; 4xx errors
+    such as ValidationError or ModelError are caused by the input and do not.
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in _UNHEALTHY_CODES or status == 429 or status >= 500
+    return isinstance(error, (BotoConnectionError, HTTPClientError))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated failures instead of waiting on a dead dependency.
+
+    closed: calls go through; fail_threshold consecutive failures open the circuit.
+    open: calls raise CircuitOpenError until reset_timeout seconds have passed.
+    half_open: one probe call goes through; success closes the circuit, failure
+    re-opens it.
+
+    Only exceptions for which is_failure(error) is true count as failures; any
+    other exception means the dependency answered, and is treated as a success.
+    """
+
+    def __init__(self, fail_threshold=5, reset_timeout=30, is_failure=lambda error: True):
+        self.fail_threshold = fail_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.state = 'closed'
+        self.fail_count = 0
+        self.opened_at = 0.0
+
+    def call(self, fn, *args, **kwargs):
+        if self.state == 'open':
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("circuit open; not calling dependency")
+            self.state = 'half_open'
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if not self.is_failure(e):
+                self.state = 'closed'
+                self.fail_count = 0
+                raise
+            self.fail_count += 1
+            if self.state == 'half_open' or self.fail_count >= self.fail_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            raise
+        self.state = 'closed'
+        self.fail_count = 0
+        return result
+
+
+# Module scope, so the breaker state carries across warm invocations of a container
+_BREAKER = CircuitBreaker(is_failure=_is_unhealthy)
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff before retry number attempt + 1."""
+    time.sleep(random.uniform(0, min(EMBED_RETRY_CAP_SECS, EMBED_RETRY_BASE_SECS * (2 ** attempt))))
+
+
+@functools.lru_cache(maxsize=512)
+def get_embedding(text, endpoint_name):
+    """Get embedding vector from SageMaker endpoint with retries and error handling.
+
+    Results are cached per process, so repeat texts skip SageMaker. The
+    embedding is returned as a tuple so cached values cannot be mutated by
+    callers. Raises CircuitOpenError while the endpoint is considered down,
+    and ValueError if the endpoint returns no usable embedding; neither is cached.
+    """
+    attempts = EMBED_RETRY_ATTEMPTS
+    for attempt in range(attempts):
+        try:
+            response = _BREAKER.call(
+                sagemaker_runtime.invoke_endpoint,
+                EndpointName=endpoint_name,
+                ContentType='application/json',
+                Body=dumps({'inputs': text})
+            )
+
+            # HuggingFace returns a nested array such as [[[embedding]]]; the
+            # shape is learned from the first response and unwrapped directly
+            embedding = extract_embedding(loads(response['Body'].read()))
+            if not isinstance(embedding, list) or not embedding:
+                raise ValueError(f"SageMaker returned no usable embedding: {embedding!r:.100}")
+            return tuple(embedding)
+
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            print(f"ClientError calling SageMaker invoke_endpoint: {code} - {e}")
+            # Retry on transient errors only; a bad input fails the same way
+            # every time. Jitter keeps concurrent invocations from retrying in
+            # lockstep.
+            if _is_unhealthy(e) and attempt < attempts - 1:
+                _backoff(attempt)
+                continue
+            raise
+        except (BotoConnectionError, HTTPClientError) as e:
+            # Connection failures and read timeouts (what botocore's own
+            # retries would have covered)
+            print(f"Connection error calling SageMaker invoke_endpoint: {e}")
+            if attempt < attempts - 1:
+                _backoff(attempt)
+                continue
+            raise
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"Unexpected error calling SageMaker: {e}")
+            raise
+    raise ValueError("EMBED_RETRY_ATTEMPTS must be at least 1")
@@ -0,0 +1,100 @@
+"""
+Helpers for calling the HuggingFace feature-extraction endpoint on SageMaker
+and decoding its output.
+
+The nesting of the endpoint's output ([[[embedding]]], [[embedding]] or
+[embedding]) is fixed per deployment, so it is detected once from the first
+non-empty response and a specialized extractor is used from then on instead
+of re-checking the shape on every call. Single and batched responses are
+learned separately, since a batch adds one level (one row per input).
+
+CLIENT_CONFIG holds the botocore client settings shared by the bulk ingest
+paths and scripts.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # optional; falls back to stdlib json
+    orjson = None
+
+# orjson parses the float arrays in SageMaker responses several times faster.
+# Both variants accept the raw response bytes, and invoke_endpoint accepts
+# either bytes or str for the request Body.
+loads = orjson.loads if orjson else json.loads
+dumps = orjson.dumps if orjson else json.dumps
+
+# botocore client settings (pass as Config(**CLIENT_CONFIG) or AioConfig(**...)).
+# A pool large enough for every worker keeps TLS connections warm instead of
+# serializing threads on the default 10 connections. Adaptive retries handle
+# throttling and transient errors, so callers do not retry themselves.
+CLIENT_CONFIG = dict(
+    max_pool_connections=64,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+    tcp_keepalive=True,
+)
+
+# Single-input result -> embedding, keyed by nesting depth. A batched result is
+# one such single-input result per row, so the same extractors unwrap each row.
+_SINGLE = {
+    1: lambda result: result,
+    2: lambda result: result[0],
+    3: lambda result: result[0][0],
+}
+
+# Learned separately: a batched result has one more level than a single one
+_single_depth = None
+_row_depth = None
+
+
+def _nesting_depth(result):
+    depth = 0
+    while isinstance(result, list) and result:
+        depth += 1
+        result = result[0]
+    return depth
+
+
+def extract_embedding(result):
+    """Return the embedding vector from a single-input response."""
+    global _single_depth
+    if _single_depth is None:
+        depth = _nesting_depth(result)
+        if depth not in _SINGLE:
+            # empty, non-list or unrecognized output; nothing to learn from
+            return result
+        _single_depth = depth
+    return _SINGLE[_single_depth](result)
+
+
+def extract_embeddings(result, count):
+    """Return one embedding per input from a batched response, or None if the row count is off."""
+    global _row_depth
+    if not isinstance(result, list) or len(result) != count:
+        return None
+    if _row_depth is None:
+        depth = _nesting_depth(result[0])
+        if depth not in _SINGLE:
+            return None
+        _row_depth = depth
+    extract = _SINGLE[_row_depth]
+    return [extract(row) for row in result]
+
+
+def get_embeddings_batch(client, endpoint_name, texts):
+    """Embed texts with a single invoke_endpoint call; returns one embedding per text.
+
+    Raises ValueError if the endpoint does not return one row per input (e.g.
+    a container that treats the array as a single sequence).
+    """
+    texts = list(texts)
+    response = client.invoke_endpoint(
+        EndpointName=endpoint_name,
+        ContentType='application/json',
+        Body=dumps({'inputs': texts})
+    )
+    embeddings = extract_embeddings(loads(response['Body'].read()), len(texts))
+    if embeddings is None:
+        raise ValueError(f"Expected {len(texts)} embeddings from batched request")
+    return embeddings
@@ -7,22 +7,58 @@ Usage:
   uv run ingest_from_file.py data/sample_docs.json
 
 Or directly:
-  python3 ingest_from_file.py data/sample_docs.json
+  python3 ingest_from_file.py data/sample_docs.json [--no-cache] [--async]
 
-The script reads a JSON array of {"text": ..., "metadata": {...}} and ingests each document.
+The script reads a JSON array (or a .jsonl file, one object per line) of
+{"text": ..., "metadata": {...}} and ingests each document. Documents are streamed
+from the file (via ijson for JSON arrays, when installed), so embedding starts
+as soon as the first batch has been read.
+Documents are embedded BATCH_SIZE at a time (default 16) with one SageMaker call per batch,
+and up to INGEST_CONCURRENCY batches (default 8) are processed in parallel threads.
+Vectors are stored PUT_BATCH_SIZE (default 500) per put_vectors call.
+
+Embeddings are cached locally in a sqlite file keyed by sha256 of the endpoint
+name and text, so re-running on the same (or overlapping) data skips SageMaker
+for repeats. Pass --no-cache to always call the endpoint.
+
+Pass --async (or set INGEST_ASYNC=1) to run the SageMaker calls on asyncio
+instead of threads; this needs aioboto3, and INGEST_CONCURRENCY then caps the
+number of in-flight SageMaker requests.
 """
 
+import argparse
+import asyncio
+import hashlib
 import json
+import logging
 import os
+import sqlite3
 import sys
-import time
+import threading
 import uuid
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from dotenv import load_dotenv
 import boto3
+import numpy as np
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import datetime
 
+from _hf_output import CLIENT_CONFIG, dumps, extract_embedding, extract_embeddings, get_embeddings_batch as _invoke_batch, loads
+
+try:
+    import aioboto3
+    from aiobotocore.config import AioConfig
+except ImportError:  # optional; only needed for --async
+    aioboto3 = None
+
+try:
+    import ijson
+except ImportError:  # optional; JSON arrays are then loaded in one go
+    ijson = None
+
 # Load .env from project root
 env_path = Path(__file__).parent.parent.parent / '.env'
 load_dotenv(env_path, override=True)
@@ -30,100 +66,444 @@ load_dotenv(env_path, override=True)
 VECTOR_BUCKET = os.getenv('VECTOR_BUCKET')
 SAGEMAKER_ENDPOINT = os.getenv('SAGEMAKER_ENDPOINT')
 INDEX_NAME = os.getenv('INDEX_NAME', 'despme-index')
+# Number of documents sent to SageMaker per invoke_endpoint call
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 16))
+# Number of batches in flight at once. Keep this at or below the endpoint's
+# MaxConcurrentInvocationsPerInstance (or serverless max_concurrency), otherwise
+# the extra requests are just throttled by SageMaker.
+INGEST_CONCURRENCY = int(os.getenv('INGEST_CONCURRENCY', 8))
+# Vectors per put_vectors call (S3 Vectors accepts at most 500)
+PUT_BATCH_SIZE = min(int(os.getenv('PUT_BATCH_SIZE', 500)), 500)
+# Run the asyncio ingest path by default (same as passing --async)
+INGEST_ASYNC = os.getenv('INGEST_ASYNC', '').lower() in ('1', 'true', 'yes')
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', str(Path(__file__).parent / '.embedding_cache.sqlite3'))
+
+logger = logging.getLogger(__name__)
 
 if not VECTOR_BUCKET or not SAGEMAKER_ENDPOINT:
-    print("Error: Please set VECTOR_BUCKET and SAGEMAKER_ENDPOINT in your .env before running this script.")
+    logger.error("Error: Please set VECTOR_BUCKET and SAGEMAKER_ENDPOINT in your .env before running this script.")
     sys.exit(1)
 
-sagemaker_runtime = boto3.client('sagemaker-runtime')
-s3_vectors = boto3.client('s3vectors')
+# Pooled keep-alive connections and adaptive retries (see _hf_output), so the
+# calls below do not retry themselves
+sagemaker_runtime = boto3.client('sagemaker-runtime', config=Config(**CLIENT_CONFIG))
+s3_vectors = boto3.client('s3vectors', config=Config(**CLIENT_CONFIG))
 
+class EmbeddingCache:
+    """sqlite-backed cache of embeddings, safe to share between threads.
 
-def get_embedding(text, attempts=3, delay=1):
-    for attempt in range(attempts):
-        try:
-            response = sagemaker_runtime.invoke_endpoint(
-                EndpointName=SAGEMAKER_ENDPOINT,
-                ContentType='application/json',
-                Body=json.dumps({'inputs': text})
-            )
-            result = json.loads(response['Body'].read().decode())
-            # unpack nested HF output
-            if isinstance(result, list) and len(result) > 0:
-                if isinstance(result[0], list) and len(result[0]) > 0:
-                    if isinstance(result[0][0], list):
-                        return result[0][0]
-                    return result[0]
-            return result
-        except ClientError as e:
-            print(f"SageMaker ClientError: {e}")
-            if attempt < attempts - 1:
-                time.sleep(delay)
-                delay *= 2
-                continue
-            raise
-        except Exception as e:
-            print(f"Unexpected SageMaker error: {e}")
+    Keys are sha256(endpoint + NUL + text), so switching SAGEMAKER_ENDPOINT to
+    a different model never serves vectors computed by the old one.
+    """
+
+    def __init__(self, path, endpoint_name):
+        self._prefix = endpoint_name.encode() + b'\0'
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB)')
+
+    def _key(self, text):
+        return hashlib.sha256(self._prefix + text.encode()).hexdigest()
+
+    def get_many(self, texts):
+        """Return a list aligned with texts holding cached embeddings, or None for misses."""
+        keys = [self._key(text) for text in texts]
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT key, vec FROM embeddings WHERE key IN ({placeholders})', keys
+            ).fetchall()
+        found = {key: np.frombuffer(vec, dtype=np.float32) for key, vec in rows}
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts, embeddings):
+        rows = [
+            (self._key(text), embedding.tobytes())
+            for text, embedding in zip(texts, embeddings)
+            if embedding is not None
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)', rows)
+
+    def close(self):
+        self._conn.close()
+
+
+def _to_vector(embedding):
+    """Convert a parsed embedding to a 1-D float32 array, or None if it is not a usable vector."""
+    try:
+        vector = np.asarray(embedding, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    if vector.ndim != 1 or vector.size == 0:
+        return None
+    return vector
+
+
+def _to_matrix(embeddings):
+    """Stack a batch of embeddings into one (N, D) float32 array; ragged batches stay a list."""
+    try:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+    except (TypeError, ValueError):
+        return [_to_vector(embedding) for embedding in embeddings]
+    if matrix.ndim != 2 or matrix.shape[1] == 0:
+        return [_to_vector(embedding) for embedding in embeddings]
+    return matrix
+
+
+def get_embedding(text):
+    response = sagemaker_runtime.invoke_endpoint(
+        EndpointName=SAGEMAKER_ENDPOINT,
+        ContentType='application/json',
+        Body=dumps({'inputs': text})
+    )
+    return _to_vector(extract_embedding(loads(response['Body'].read())))
+
+
+def _is_array_rejection(error):
+    """True if SageMaker rejected the request body, i.e. the container does not accept array inputs."""
+    return error.response.get('Error', {}).get('Code') in ('ModelError', 'ValidationError')
+
+
+def get_embeddings_batch(texts):
+    """Embed several texts with a single invoke_endpoint call.
+
+    Falls back to one get_embedding call per text if the container rejects
+    array inputs or returns an unexpected number of rows.
+    """
+    try:
+        return _to_matrix(_invoke_batch(sagemaker_runtime, SAGEMAKER_ENDPOINT, texts))
+    except ValueError:
+        logger.warning("Batch embedding returned unexpected shape; falling back to single requests")
+    except ClientError as e:
+        if not _is_array_rejection(e):
             raise
+        logger.warning(f"Batch embedding rejected ({e}); falling back to single requests")
+    return [get_embedding(text) for text in texts]
+
+
+def _put_vectors(vectors):
+    try:
+        s3_vectors.put_vectors(
+            vectorBucketName=VECTOR_BUCKET,
+            indexName=INDEX_NAME,
+            vectors=vectors
+        )
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        logger.error(f"S3Vectors ClientError: {code} - {e}")
+        if code == 'NotFoundException':
+            raise RuntimeError(f"Index '{INDEX_NAME}' not found in bucket '{VECTOR_BUCKET}'")
+        raise
+
+
+def _is_item_rejection(error):
+    """True if put_vectors rejected the request contents (some vector is invalid).
 
+    Throttling and server errors are not: retrying those one vector at a time
+    would turn a throttled batch into hundreds of extra requests.
+    """
+    return error.response.get('Error', {}).get('Code') == 'ValidationException'
 
-def put_vector(vector_id, embedding, metadata, attempts=3, delay=1):
-    for attempt in range(attempts):
+
+def _vector_records(items):
+    return [
+        # boto3 needs plain floats; convert from float32 only at the API boundary
+        {"key": vector_id, "data": {"float32": embedding.tolist()}, "metadata": metadata}
+        for vector_id, embedding, metadata in items
+    ]
+
+
+def put_vectors_batch(items):
+    """Store (vector_id, embedding, metadata) tuples with a single put_vectors call.
+
+    If the batch is rejected as invalid, each vector is retried on its own so
+    only the offending IDs fail; any other error (throttling, 5xx) fails the
+    whole batch. Returns the list of vector IDs that were not stored.
+    """
+    vectors = _vector_records(items)
+    try:
+        _put_vectors(vectors)
+        return []
+    except ClientError as e:
+        if len(vectors) == 1 or not _is_item_rejection(e):
+            logger.warning(f"  ✗ Failed to store {len(vectors)} vectors: {e}")
+            return [vector['key'] for vector in vectors]
+        logger.warning(f"  Batch of {len(vectors)} vectors rejected; retrying individually")
+
+    failed = []
+    for i, vector in enumerate(vectors):
         try:
-            s3_vectors.put_vectors(
-                vectorBucketName=VECTOR_BUCKET,
-                indexName=INDEX_NAME,
-                vectors=[{
-                    "key": vector_id,
-                    "data": {"float32": embedding},
-                    "metadata": metadata
-                }]
-            )
-            return
+            _put_vectors([vector])
         except ClientError as e:
-            code = e.response.get('Error', {}).get('Code')
-            print(f"S3Vectors ClientError: {code} - {e}")
-            if code == 'NotFoundException':
-                raise RuntimeError(f"Index '{INDEX_NAME}' not found in bucket '{VECTOR_BUCKET}'")
-            if attempt < attempts - 1:
-                time.sleep(delay)
-                delay *= 2
-                continue
-            raise
-
+            if not _is_item_rejection(e):
+                # throttled or failing; give up on the rest of the batch
+                logger.warning(f"  ✗ Failed to store {len(vectors) - i} vectors: {e}")
+                return failed + [v['key'] for v in vectors[i:]]
+            logger.warning(f"  ✗ Failed to store {vector['key']}: {e}")
+            failed.append(vector['key'])
+    return failed
 
-def ingest_docs(docs_path):
-    with open(docs_path, 'r') as f:
-        docs = json.load(f)
 
-    print(f"Ingesting {len(docs)} documents from {docs_path}")
-    successes = 0
+def _build_items(batch, embeddings, timestamp):
+    """Pair documents with their embeddings. Returns ([(id, embedding, metadata), ...], failures)."""
+    items = []
     failures = 0
+    for doc, embedding in zip(batch, embeddings):
+        if embedding is None:
+            logger.warning("  ✗ Invalid embedding returned; skipping")
+            failures += 1
+            continue
+        # add timestamp; the parsed document owns its metadata dict, so
+        # update it in place instead of copying it per document
+        metadata = doc.get('metadata') or {}
+        if not isinstance(metadata, dict):
+            logger.warning(f"  ✗ Metadata must be an object, got {type(metadata).__name__}; skipping")
+            failures += 1
+            continue
+        vector_id = str(uuid.uuid4())
+        metadata['timestamp'] = timestamp
+        items.append((vector_id, embedding, metadata))
+    return items, failures
 
-    for i, doc in enumerate(docs, 1):
-        text = doc.get('text')
-        metadata = doc.get('metadata', {})
-        print(f"[{i}/{len(docs)}] Getting embedding for text (len={len(text or '')})...")
+
+def _cached_embeddings(cache, texts):
+    """Look texts up in the cache. Returns (embeddings with None for misses, miss indices)."""
+    embeddings = cache.get_many(texts) if cache else [None] * len(texts)
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if cache and len(misses) < len(texts):
+        logger.debug(f"  {len(texts) - len(misses)}/{len(texts)} embeddings served from cache")
+    return embeddings, misses
+
+
+def _merge_embeddings(cache, texts, embeddings, misses, fresh):
+    """Slot freshly computed embeddings into place and store them in the cache."""
+    for i, embedding in zip(misses, fresh):
+        embeddings[i] = embedding
+    if cache:
+        cache.put_many([texts[i] for i in misses], fresh)
+    return embeddings
+
+
+def _embed_batch(batch, start, timestamp, cache=None):
+    """Embed one batch of documents. Returns ([(id, embedding, metadata), ...], failures)."""
+    texts = [doc.get('text') or '' for doc in batch]
+    logger.debug(f"[{start + 1}-{start + len(batch)}] Getting embeddings for {len(batch)} documents...")
+    try:
+        embeddings, misses = _cached_embeddings(cache, texts)
+        if misses:
+            fresh = get_embeddings_batch([texts[i] for i in misses])
+            _merge_embeddings(cache, texts, embeddings, misses, fresh)
+    except Exception as e:
+        logger.error(f"  ✗ Failed to embed batch starting at {start + 1}: {e}")
+        return [], len(batch)
+    return _build_items(batch, embeddings, timestamp)
+
+
+def _iter_docs(docs_path):
+    """Yield documents one at a time from a JSON array or .jsonl file."""
+    if str(docs_path).endswith('.jsonl'):
+        with open(docs_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield loads(line)
+    elif ijson is not None:
+        with open(docs_path, 'rb') as f:
+            # use_float keeps numeric metadata as float rather than Decimal
+            yield from ijson.items(f, 'item', use_float=True)
+    else:
+        with open(docs_path, 'r') as f:
+            yield from json.load(f)
+
+
+def _iter_batches(docs, size):
+    """Yield (start_index, batch) slices of an iterable of documents."""
+    docs = iter(docs)
+    start = 0
+    while True:
+        batch = list(islice(docs, size))
+        if not batch:
+            return
+        yield start, batch
+        start += len(batch)
+
+
+def ingest_docs(docs_path, use_cache=True, use_async=None):
+    """Ingest every document in docs_path.
+
+    use_async selects the asyncio path (needs aioboto3); it defaults to the
+    INGEST_ASYNC setting.
+    """
+    if use_async is None:
+        use_async = INGEST_ASYNC
+    if use_async and aioboto3 is None:
+        raise RuntimeError("The asyncio ingest path needs aioboto3; install it or drop --async / INGEST_ASYNC")
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH, SAGEMAKER_ENDPOINT) if use_cache else None
+    run = _IngestRun(cache)
+    logger.info(f"Ingesting documents from {docs_path} "
+                f"(batch size {BATCH_SIZE}, concurrency {INGEST_CONCURRENCY}"
+                f"{', asyncio' if use_async else ''})")
+    try:
+        if use_async:
+            asyncio.run(_ingest_docs_async(docs_path, run))
+        else:
+            _ingest_docs_threaded(docs_path, run)
+    finally:
+        if cache:
+            cache.close()
+    logger.info(f"Finished: {run.successes} succeeded, {run.failures} failed")
+
+
+def _ingest_timestamp():
+    """One ingest-run timestamp shared by every document, formatted once."""
+    return datetime.datetime.now(datetime.UTC).isoformat(timespec='seconds')
+
+
+class _IngestRun:
+    """State shared by the threaded and asyncio ingest paths.
+
+    Embedded items are buffered until a put_vectors batch is full; store()
+    writes one batch and tallies the results.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.timestamp = _ingest_timestamp()
+        self.successes = 0
+        self.failures = 0
+        self.pending = []
+
+    def add(self, items, failures):
+        """Queue one embedded batch. Returns the put_vectors batches that are now full."""
+        self.failures += failures
+        self.pending.extend(items)
+        full = []
+        while len(self.pending) >= PUT_BATCH_SIZE:
+            full.append(self.pending[:PUT_BATCH_SIZE])
+            del self.pending[:PUT_BATCH_SIZE]
+        return full
+
+    def remainder(self):
+        """Take the last, partially filled put_vectors batch (if any)."""
+        rest, self.pending = self.pending, []
+        return [rest] if rest else []
+
+    def store(self, batch):
         try:
-            embedding = get_embedding(text)
-            if not isinstance(embedding, list) or len(embedding) == 0:
-                print("  ✗ Invalid embedding returned; skipping")
-                failures += 1
-                continue
-
-            vector_id = str(uuid.uuid4())
-            # add timestamp
-            metadata = {**metadata, 'timestamp': datetime.datetime.utcnow().isoformat()}
-            put_vector(vector_id, embedding, metadata)
-            print(f"  ✓ Ingested as {vector_id}")
-            successes += 1
+            failed = put_vectors_batch(batch)
         except Exception as e:
-            print(f"  ✗ Failed to ingest document: {e}")
-            failures += 1
+            logger.error(f"  ✗ Failed to store {len(batch)} vectors: {e}")
+            failed = [vector_id for vector_id, _, _ in batch]
+        self.successes += len(batch) - len(failed)
+        self.failures += len(failed)
+        logger.info(f"  ✓ Stored {len(batch) - len(failed)}/{len(batch)} vectors "
+                    f"(processed {self.successes + self.failures}, last={batch[-1][0]})")
+
+
+def _ingest_docs_threaded(docs_path, run):
+    def collect(done):
+        for future in done:
+            for batch in run.add(*future.result()):
+                run.store(batch)
+
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY) as executor:
+        for start, batch in _iter_batches(_iter_docs(docs_path), BATCH_SIZE):
+            # keep reading ahead bounded so large files are never fully in memory
+            if len(in_flight) >= INGEST_CONCURRENCY * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(executor.submit(_embed_batch, batch, start, run.timestamp, run.cache))
+        collect(wait(in_flight).done)
+    for batch in run.remainder():
+        run.store(batch)
+
+
+# ---------------------------------------------------------------------------
+# asyncio path (requires aioboto3; enable with --async or INGEST_ASYNC=1)
+#
+# Only the SageMaker calls are async. The sqlite cache and put_vectors (one
+# call per PUT_BATCH_SIZE vectors) run in worker threads via asyncio.to_thread
+# so they never block the event loop.
+# ---------------------------------------------------------------------------
+
+async def _invoke_endpoint_async(sagemaker, semaphore, inputs):
+    # One semaphore slot per request, so the per-text fallback below stays
+    # within INGEST_CONCURRENCY as well
+    async with semaphore:
+        response = await sagemaker.invoke_endpoint(
+            EndpointName=SAGEMAKER_ENDPOINT,
+            ContentType='application/json',
+            Body=dumps({'inputs': inputs})
+        )
+        body = await response['Body'].read()
+    return loads(body)
+
+
+async def get_embeddings_batch_async(sagemaker, semaphore, texts):
+    """Async counterpart of get_embeddings_batch; semaphore caps in-flight SageMaker calls."""
+    try:
+        embeddings = extract_embeddings(await _invoke_endpoint_async(sagemaker, semaphore, texts), len(texts))
+        if embeddings is not None:
+            return _to_matrix(embeddings)
+        logger.warning("Batch embedding returned unexpected shape; falling back to single requests")
+    except ClientError as e:
+        if not _is_array_rejection(e):
+            raise
+        logger.warning(f"Batch embedding rejected ({e}); falling back to single requests")
+    results = await asyncio.gather(*(_invoke_endpoint_async(sagemaker, semaphore, text) for text in texts))
+    return [_to_vector(extract_embedding(result)) for result in results]
+
+
+async def _embed_batch_async(sagemaker, semaphore, batch, start, run):
+    """Async counterpart of _embed_batch."""
+    texts = [doc.get('text') or '' for doc in batch]
+    logger.debug(f"[{start + 1}-{start + len(batch)}] Getting embeddings for {len(batch)} documents...")
+    try:
+        embeddings, misses = await asyncio.to_thread(_cached_embeddings, run.cache, texts)
+        if misses:
+            fresh = await get_embeddings_batch_async(sagemaker, semaphore, [texts[i] for i in misses])
+            await asyncio.to_thread(_merge_embeddings, run.cache, texts, embeddings, misses, fresh)
+    except Exception as e:
+        logger.error(f"  ✗ Failed to embed batch starting at {start + 1}: {e}")
+        return [], len(batch)
+    return _build_items(batch, embeddings, run.timestamp)
+
+
+async def _ingest_docs_async(docs_path, run):
+    semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+    async def collect(done):
+        for task in done:
+            for batch in run.add(*task.result()):
+                await asyncio.to_thread(run.store, batch)
+
+    session = aioboto3.Session()
+    async with session.client('sagemaker-runtime', config=AioConfig(**CLIENT_CONFIG)) as sagemaker:
+        in_flight = set()
+        for start, batch in _iter_batches(_iter_docs(docs_path), BATCH_SIZE):
+            # keep reading ahead bounded so large files are never fully in memory
+            if len(in_flight) >= INGEST_CONCURRENCY * 2:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                await collect(done)
+            in_flight.add(asyncio.create_task(_embed_batch_async(sagemaker, semaphore, batch, start, run)))
+        if in_flight:
+            done, _ = await asyncio.wait(in_flight)
+            await collect(done)
+    for batch in run.remainder():
+        await asyncio.to_thread(run.store, batch)
+
 
-    print(f"Finished: {successes} succeeded, {failures} failed")
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Ingest a JSON file of documents into S3 Vectors')
+    parser.add_argument('path', nargs='?', default='data/sample_docs.json', help='JSON array or .jsonl file of {"text", "metadata"} documents')
+    parser.add_argument('--no-cache', action='store_true', help='Always call SageMaker; do not read or write the local embedding cache')
+    parser.add_argument('--async', dest='use_async', action='store_true', default=INGEST_ASYNC, help='Run SageMaker calls on asyncio instead of threads (requires aioboto3)')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    path = sys.argv[1] if len(sys.argv) > 1 else 'data/sample_docs.json'
-    ingest_docs(path)
+    args = _parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    ingest_docs(args.path, use_cache=not args.no_cache, use_async=args.use_async)
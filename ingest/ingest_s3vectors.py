@@ -1,19 +1,35 @@
 """
 Lambda function for ingesting text into S3 Vectors with embeddings.
+
+Set CACHE_TABLE to a DynamoDB table (partition key "text_hash", type S) to cache
+embeddings by sha256(endpoint + NUL + text); the Lambda role then also needs
+dynamodb:GetItem and dynamodb:PutItem on that table.
 """
 
+import hashlib
 import json
+import logging
 import os
 import time
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 import datetime
 import uuid
+from array import array
+
+from _hf_output import CLIENT_CONFIG, dumps, extract_embedding, loads
+
+# The Lambda runtime attaches its own handler to the root logger; only the level
+# needs setting. Each request logs a single structured JSON line.
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 # Environment variables
 VECTOR_BUCKET = os.environ.get('VECTOR_BUCKET', 'my-despicable-bucket12212025')
 SAGEMAKER_ENDPOINT = os.environ.get('SAGEMAKER_ENDPOINT')
 INDEX_NAME = os.environ.get('INDEX_NAME', 'despme-index')
+CACHE_TABLE = os.environ.get('CACHE_TABLE')
 
 # Validate environment variables at startup (fail early with clear message)
 if not SAGEMAKER_ENDPOINT:
@@ -23,48 +39,90 @@ if not VECTOR_BUCKET:
 if not INDEX_NAME:
     raise RuntimeError("INDEX_NAME is not set; set it in Lambda env or .env")
 
-# Initialize AWS clients
-sagemaker_runtime = boto3.client('sagemaker-runtime')
-s3_vectors = boto3.client('s3vectors')
+# Initialize AWS clients. Clients live at module scope so warm invocations reuse
+# their keep-alive connections; adaptive retries handle throttling and transient
+# errors, so the calls below do not retry themselves.
+_client_config = Config(**CLIENT_CONFIG)
+sagemaker_runtime = boto3.client('sagemaker-runtime', config=_client_config)
+s3_vectors = boto3.client('s3vectors', config=_client_config)
+dynamodb = boto3.client('dynamodb', config=_client_config) if CACHE_TABLE else None
+
+
+def _cache_get(text_hash):
+    """Return the cached embedding for text_hash, or None. Cache errors never fail a request."""
+    try:
+        item = dynamodb.get_item(TableName=CACHE_TABLE, Key={'text_hash': {'S': text_hash}}).get('Item')
+        if not item:
+            return None
+        return array('f', item['embedding']['B']).tolist()
+    except (ClientError, BotoCoreError, KeyError, ValueError) as e:
+        # DynamoDB errors, timeouts/connection errors, or a malformed item
+        logger.warning(f"Embedding cache lookup failed: {e!r}")
+        return None
+
+
+def _cache_put(text_hash, embedding):
+    try:
+        dynamodb.put_item(
+            TableName=CACHE_TABLE,
+            Item={
+                'text_hash': {'S': text_hash},
+                'embedding': {'B': array('f', embedding).tobytes()}
+            }
+        )
+    except (ClientError, BotoCoreError) as e:
+        logger.warning(f"Embedding cache write failed: {e!r}")
 
 
 def get_embedding(text):
-    """Get embedding vector from SageMaker endpoint with retries and error handling."""
-    attempts = 3
-    delay = 1
-    for attempt in range(attempts):
-        try:
-            response = sagemaker_runtime.invoke_endpoint(
-                EndpointName=SAGEMAKER_ENDPOINT,
-                ContentType='application/json',
-                Body=json.dumps({'inputs': text})
-            )
-
-            result = json.loads(response['Body'].read().decode())
-            # HuggingFace returns nested array [[[embedding]]], extract the actual embedding
-            embedding = None
-            if isinstance(result, list) and len(result) > 0:
-                if isinstance(result[0], list) and len(result[0]) > 0:
-                    if isinstance(result[0][0], list):
-                        embedding = result[0][0]  # Extract from [[[embedding]]]
-                    else:
-                        embedding = result[0]  # Extract from [[embedding]]
-            else:
-                embedding = result  # Return as-is if not nested
-
-            return embedding
+    """Get embedding vector, from the DynamoDB cache when CACHE_TABLE is set, else from SageMaker."""
+    if not dynamodb:
+        return _invoke_embedding(text)
 
-        except ClientError as e:
-            code = e.response.get('Error', {}).get('Code')
-            print(f"ClientError calling SageMaker invoke_endpoint: {code} - {e}")
-            if attempt < attempts - 1:
-                time.sleep(delay)
-                delay *= 2
-                continue
-            raise
-        except Exception as e:
-            print(f"Unexpected error calling SageMaker: {e}")
-            raise
+    # Keyed by endpoint too, so a different model never gets another model's vectors
+    text_hash = hashlib.sha256(f"{SAGEMAKER_ENDPOINT}\0{text}".encode()).hexdigest()
+    embedding = _cache_get(text_hash)
+    if embedding is not None:
+        logger.debug("Embedding served from cache")
+        return embedding
+    embedding = _invoke_embedding(text)
+    if isinstance(embedding, list) and embedding:
+        _cache_put(text_hash, embedding)
+    return embedding
+
+
+def _invoke_embedding(text):
+    """Get embedding vector from SageMaker endpoint."""
+    try:
+        response = sagemaker_runtime.invoke_endpoint(
+            EndpointName=SAGEMAKER_ENDPOINT,
+            ContentType='application/json',
+            Body=dumps({'inputs': text})
+        )
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        logger.error(f"ClientError calling SageMaker invoke_endpoint: {code} - {e}")
+        raise
+    # HuggingFace returns nested array [[[embedding]]], extract the actual embedding
+    return extract_embedding(loads(response['Body'].read()))
+
+
+def put_vectors_batch(items):
+    """Store (vector_id, embedding, metadata) tuples with a single put_vectors call."""
+    vectors = [
+        {"key": vector_id, "data": {"float32": embedding}, "metadata": metadata}
+        for vector_id, embedding, metadata in items
+    ]
+    try:
+        s3_vectors.put_vectors(
+            vectorBucketName=VECTOR_BUCKET,
+            indexName=INDEX_NAME,
+            vectors=vectors
+        )
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        logger.error(f"ClientError putting vectors: {code} - {e}")
+        raise
 
 
 def lambda_handler(event, context):
@@ -79,6 +137,17 @@ def lambda_handler(event, context):
         }
     }
     """
+    started = time.perf_counter()
+    log = {'request_id': getattr(context, 'aws_request_id', None)}
+    response = _handle(event, log)
+    log['status'] = response['statusCode']
+    log['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(json.dumps(log))
+    return response
+
+
+def _handle(event, log):
+    """Process one ingest request, recording what happened in log."""
     try:
         # Parse the request body
         if isinstance(event.get('body'), str):
@@ -96,12 +165,12 @@ def lambda_handler(event, context):
             }
         
         # Get embedding from SageMaker
-        print(f"Getting embedding for text: {text[:100]}...")
+        log['text_length'] = len(text)
         embedding = get_embedding(text)
 
         # Validate embedding
         if not isinstance(embedding, list) or len(embedding) == 0:
-            print("Invalid embedding returned from SageMaker")
+            log['error'] = 'invalid_embedding'
             return {
                 'statusCode': 500,
                 'body': json.dumps({'error': 'Invalid embedding returned from SageMaker'})
@@ -110,44 +179,27 @@ def lambda_handler(event, context):
         # Generate unique ID for the vector
         vector_id = str(uuid.uuid4())
 
-        # Store in S3 Vectors with retries and error handling
-        print(f"Storing vector in bucket: {VECTOR_BUCKET}, index: {INDEX_NAME}")
-        attempts = 3
-        delay = 1
-        for attempt in range(attempts):
-            try:
-                s3_vectors.put_vectors(
-                    vectorBucketName=VECTOR_BUCKET,
-                    indexName=INDEX_NAME,
-                    vectors=[{
-                        "key": vector_id,
-                        "data": {"float32": embedding},
-                        "metadata": {
-                            "text": text,
-                            "timestamp": datetime.datetime.utcnow().isoformat(),
-                            **metadata  # Include any additional metadata
-                        }
-                    }]
-                )
-                break
-            except ClientError as e:
-                code = e.response.get('Error', {}).get('Code')
-                print(f"ClientError putting vectors: {code} - {e}")
-                if code == 'NotFoundException':
-                    return {
-                        'statusCode': 404,
-                        'body': json.dumps({'error': f"Index '{INDEX_NAME}' not found in bucket '{VECTOR_BUCKET}'"})
-                    }
-                if code in ('AccessDeniedException', 'AccessDenied'):
-                    return {
-                        'statusCode': 403,
-                        'body': json.dumps({'error': 'Access denied. Ensure IAM role has s3vectors:* permissions'})
-                    }
-                if attempt < attempts - 1:
-                    time.sleep(delay)
-                    delay *= 2
-                    continue
-                raise
+        # Store in S3 Vectors
+        log['document_id'] = vector_id
+        # Fill in the request's own metadata dict; caller-supplied keys win
+        metadata.setdefault("text", text)
+        metadata.setdefault("timestamp", datetime.datetime.now(datetime.UTC).isoformat())
+        try:
+            put_vectors_batch([(vector_id, embedding, metadata)])
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            log['error'] = code
+            if code == 'NotFoundException':
+                return {
+                    'statusCode': 404,
+                    'body': json.dumps({'error': f"Index '{INDEX_NAME}' not found in bucket '{VECTOR_BUCKET}'"})
+                }
+            if code in ('AccessDeniedException', 'AccessDenied'):
+                return {
+                    'statusCode': 403,
+                    'body': json.dumps({'error': 'Access denied. Ensure IAM role has s3vectors:* permissions'})
+                }
+            raise
         
         return {
             'statusCode': 200,
@@ -157,7 +209,7 @@ def lambda_handler(event, context):
             })
         }
     except Exception as e:
-        print(f"Error: {str(e)}")
+        log['error'] = str(e)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
@@ -6,12 +6,24 @@ Lambda deployment package creator using uv.
 import argparse
 import logging
 import os
-import site
 import sys
-import shutil
+import sysconfig
 import zipfile
 from pathlib import Path
 
+try:
+    from zlib_ng import zlib_ng
+except ImportError:  # optional; stdlib zlib is used instead
+    zlib_ng = None
+
+if zlib_ng is not None:
+    # zlib-ng is a drop-in zlib replacement with a much faster deflate; zipfile
+    # looks up zlib.compressobj at call time, so swapping the module is enough
+    zipfile.zlib = zlib_ng
+
+# Installer metadata directories that are not needed at runtime
+_SKIP_SUFFIXES = ('.dist-info', '.egg-info')
+
 
 def create_deployment_package(venv_path=None, out_zip=None, dry_run=False, exclude_pkgs=None):
     """Create a Lambda deployment package with dependencies from uv.
@@ -27,12 +39,9 @@ def create_deployment_package(venv_path=None, out_zip=None, dry_run=False, exclu
 
     # Paths
     current_dir = Path(__file__).parent
-    build_dir = current_dir / 'build'
-    package_dir = build_dir / 'package'
     zip_path = Path(out_zip) if out_zip else current_dir / 'lambda_function.zip'
 
     # Resolve virtualenv site-packages robustly
-    site_packages = None
     if venv_path:
         venv_root = Path(venv_path)
     else:
@@ -43,100 +52,82 @@ def create_deployment_package(venv_path=None, out_zip=None, dry_run=False, exclu
             # Typical venv layout: <venv>/bin/python (Unix) or <venv>/Scripts/python.exe (Windows)
             venv_root = Path(sys.executable).parents[1]
 
-    # Candidate site-packages locations
-    candidates = []
-    # Common *nix path
-    candidates.append(venv_root / 'lib')
-    # Common Windows path
-    candidates.append(venv_root / 'Lib')
-    # Try python's site module as a fallback
-    for sp in site.getsitepackages() if hasattr(site, 'getsitepackages') else []:
-        candidates.append(Path(sp))
-
-    for base in candidates:
-        try:
-            for path in base.rglob('site-packages'):
-                site_packages = path
-                break
-        except Exception:
-            continue
-        if site_packages:
-            break
+    # site-packages has a fixed location inside a venv, so probe it directly
+    # instead of walking the tree
+    candidates = [
+        # Common *nix path
+        venv_root / 'lib' / f'python{sys.version_info.major}.{sys.version_info.minor}' / 'site-packages',
+        # Common Windows path
+        venv_root / 'Lib' / 'site-packages',
+        # The running interpreter's own site-packages as a fallback
+        Path(sysconfig.get_paths()['purelib']),
+    ]
+    site_packages = next((path for path in candidates[:2] if path.is_dir()), None)
+    if site_packages is None:
+        # venv built for a different Python version: one directory listing, no recursion
+        site_packages = next((venv_root / 'lib').glob('python*/site-packages'), None)
+    if site_packages is None and candidates[2].is_dir():
+        site_packages = candidates[2]
 
     if not site_packages or not site_packages.exists():
         logger.error("Could not find site-packages. Provide --venv or ensure the venv is activated and contains installed dependencies.")
         sys.exit(1)
 
-    logger.info(f"Copying dependencies from {site_packages}...")
-
-    # Clean up previous builds
-    if build_dir.exists():
-        shutil.rmtree(build_dir)
-    if zip_path.exists():
-        os.remove(zip_path)
-
-    # Create build directory
-    package_dir.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Collecting dependencies from {site_packages}...")
 
     # Default exclusions
     if exclude_pkgs is None:
         exclude_pkgs = ['boto3', 'botocore', 's3transfer']
 
-    # Copy all dependencies to package directory
+    # Exact names plus "<pkg>-" prefixes (e.g. versioned data directories)
+    exclude_set = set(exclude_pkgs)
+    exclude_prefixes = tuple(pkg + '-' for pkg in exclude_pkgs)
+
+    # Collect top-level entries to package
+    top_level = []
     for item in site_packages.iterdir():
         name = item.name
-        # Skip dist-info and caches
-        if name.endswith('.dist-info') or name == '__pycache__':
+        # Skip packaging metadata and caches
+        if name.endswith(_SKIP_SUFFIXES) or name == '__pycache__':
             continue
         # Skip excluded top-level packages
-        if any(name == pkg or name.startswith(pkg + '-') for pkg in exclude_pkgs):
+        if name in exclude_set or name.startswith(exclude_prefixes):
             logger.debug(f"Skipping excluded package: {name}")
             continue
-        try:
-            if item.is_dir():
-                shutil.copytree(item, package_dir / name, dirs_exist_ok=True)
-            else:
-                shutil.copy2(item, package_dir)
-        except Exception as e:
-            logger.warning(f"Failed to copy {name}: {e}")
-    
-    # Copy Lambda function code
-    logger.info("Copying Lambda function code...")
-
-    # Copy S3 Vectors Lambda handlers
-    handlers = []
-    if (current_dir / 'ingest_s3vectors.py').exists():
-        handlers.append('ingest_s3vectors.py')
-        shutil.copy(current_dir / 'ingest_s3vectors.py', package_dir)
-    if (current_dir / 'search_s3vectors.py').exists():
-        handlers.append('search_s3vectors.py')
-        shutil.copy(current_dir / 'search_s3vectors.py', package_dir)
+        top_level.append(item)
+
+    # Lambda function code: S3 Vectors handlers plus the shared modules they import
+    logger.info("Collecting Lambda function code...")
+    for name in ('ingest_s3vectors.py', 'search_s3vectors.py', '_embedding.py', '_hf_output.py'):
+        if (current_dir / name).exists():
+            top_level.append(current_dir / name)
 
     if dry_run:
         # Show a summary of what would be included
-        included = [p.name for p in package_dir.iterdir()]
         print("Dry run - package would include the following top-level entries:")
-        for name in sorted(included):
+        for name in sorted(item.name for item in top_level):
             print(f" - {name}")
-        # Clean up build dir
-        shutil.rmtree(build_dir)
         return "dry-run"
 
-    # Create ZIP file
-    logger.info("Creating deployment package...")
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(package_dir):
-            # Skip __pycache__ directories
-            dirs[:] = [d for d in dirs if d != '__pycache__']
-            for file in files:
-                if file.endswith('.pyc'):
+    # Stream every file straight into the ZIP; there is no intermediate build
+    # directory, so each file is read from disk exactly once
+    logger.info(f"Creating deployment package ({'zlib-ng' if zlib_ng else 'zlib'} deflate)...")
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zipf:
+        for item in top_level:
+            try:
+                if not item.is_dir():
+                    zipf.write(item, item.name)
                     continue
-                file_path = Path(root) / file
-                arcname = file_path.relative_to(package_dir)
-                zipf.write(file_path, arcname)
-
-    # Clean up build directory
-    shutil.rmtree(build_dir)
+                for root, dirs, files in os.walk(item, followlinks=True):
+                    # Skip __pycache__ directories
+                    dirs[:] = [d for d in dirs if d != '__pycache__']
+                    for file in files:
+                        if file.endswith('.pyc'):
+                            continue
+                        file_path = Path(root) / file
+                        zipf.write(file_path, file_path.relative_to(item.parent))
+            except Exception as e:
+                logger.warning(f"Failed to add {item.name}: {e}")
 
     # Get file size
     size_mb = zip_path.stat().st_size / (1024 * 1024)
@@ -3,21 +3,38 @@ Utility to check embedding model dimensions and characteristics.
 """
 
 import boto3
-import json
 import os
+import sys
+from botocore.config import Config
 from dotenv import load_dotenv
 from pathlib import Path
 
+# Shared helpers live in the parent ingest/ directory
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from _hf_output import CLIENT_CONFIG, dumps, extract_embedding, get_embeddings_batch, loads  # noqa: E402
+
 # Load environment variables
 env_path = Path(__file__).parent.parent.parent / '.env'
 load_dotenv(env_path, override=True)
 
 SAGEMAKER_ENDPOINT = os.getenv('SAGEMAKER_ENDPOINT', 'despme--embedding-endpoint')
 
+def _embed_one(sagemaker, text):
+    """Embed a single text; returns the exception instead of raising so each case can report it."""
+    try:
+        response = sagemaker.invoke_endpoint(
+            EndpointName=SAGEMAKER_ENDPOINT,
+            ContentType='application/json',
+            Body=dumps({'inputs': text})
+        )
+        return extract_embedding(loads(response['Body'].read()))
+    except Exception as e:
+        return e
+
 def analyze_embedding_model():
     """Analyze the deployed embedding model characteristics."""
     
-    sagemaker = boto3.client('sagemaker-runtime')
+    sagemaker = boto3.client('sagemaker-runtime', config=Config(**CLIENT_CONFIG))
     
     print("🔍 Embedding Model Analysis")
     print("=" * 50)
@@ -34,21 +51,18 @@ def analyze_embedding_model():
     
     dimensions = []
     
-    for i, text in enumerate(test_cases, 1):
+    # Embed every test case in one forward pass; fall back to one call per case
+    try:
+        embeddings = get_embeddings_batch(sagemaker, SAGEMAKER_ENDPOINT, test_cases)
+    except Exception as e:
+        print(f"Batched request failed ({e}); embedding test cases one at a time")
+        embeddings = [_embed_one(sagemaker, text) for text in test_cases]
+    print()
+    
+    for i, (text, embedding) in enumerate(zip(test_cases, embeddings), 1):
         try:
-            response = sagemaker.invoke_endpoint(
-                EndpointName=SAGEMAKER_ENDPOINT,
-                ContentType='application/json',
-                Body=json.dumps({'inputs': text})
-            )
-            
-            result = json.loads(response['Body'].read().decode())
-            
-            # Extract embedding
-            if isinstance(result, list):
-                embedding = result[0][0] if isinstance(result[0], list) else result[0]
-            else:
-                embedding = result
+            if isinstance(embedding, Exception):
+                raise embedding
             
             dim = len(embedding)
             dimensions.append(dim)
@@ -1,15 +1,30 @@
 """
 Search script for exploring the Despicable Me knowledge base.
 Demonstrates semantic search capabilities with BGE-M3 embeddings.
+
+When aioboto3 is installed, main() issues all query_vectors calls concurrently
+and prints the results once they are all back.
 """
 
+import asyncio
 import os
-import json
+import sys
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from pathlib import Path
 
+try:
+    import aioboto3
+    from aiobotocore.config import AioConfig
+except ImportError:  # optional; main() then runs the searches one by one
+    aioboto3 = None
+
+# Shared helpers live in the parent ingest/ directory
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from _hf_output import CLIENT_CONFIG, dumps, extract_embedding, get_embeddings_batch, loads  # noqa: E402
+
 # Load environment variables from project root
 env_path = Path(__file__).parent.parent.parent / '.env'
 load_dotenv(env_path, override=True)
@@ -23,119 +38,163 @@ if not VECTOR_BUCKET:
     print("Error: Please run Guide 3 Step 4 to save VECTOR_BUCKET to .env")
     exit(1)
 
-# Initialize AWS clients
-s3_vectors = boto3.client('s3vectors')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
+# Initialize AWS clients with keep-alive connections and adaptive retries
+s3_vectors = boto3.client('s3vectors', config=Config(**CLIENT_CONFIG))
+sagemaker_runtime = boto3.client('sagemaker-runtime', config=Config(**CLIENT_CONFIG))
 
 def get_embedding(text):
     """Get embedding vector from SageMaker endpoint using BGE-M3."""
     response = sagemaker_runtime.invoke_endpoint(
         EndpointName=SAGEMAKER_ENDPOINT,
         ContentType='application/json',
-        Body=json.dumps({'inputs': text})
+        Body=dumps({'inputs': text})
     )
     
-    result = json.loads(response['Body'].read().decode())
     # BGE-M3 returns nested array [[[embedding]]], extract the actual embedding
-    if isinstance(result, list) and len(result) > 0:
-        if isinstance(result[0], list) and len(result[0]) > 0:
-            if isinstance(result[0][0], list):
-                return result[0][0]  # Extract from [[[embedding]]]
-            return result[0]  # Extract from [[embedding]]
-    return result  # Return as-is if not nested
-
-def search_vectors(query_text, k=5):
-    """Search for vectors by query text."""
+    return extract_embedding(loads(response['Body'].read()))
+
+def character_query(character_name):
+    """Query text used to find documents about a character."""
+    return f"{character_name} character profile personality"
+
+def _query_params(query_embedding, k, character_name=None):
+    """query_vectors arguments, optionally filtered server-side to one character."""
+    params = {
+        'vectorBucketName': VECTOR_BUCKET,
+        'indexName': INDEX_NAME,
+        'queryVector': {"float32": query_embedding},
+        'topK': k,
+        'returnDistance': True,
+        'returnMetadata': True,
+    }
+    if character_name is not None:
+        params['filter'] = {"character": {"$eq": character_name}}
+    return params
+
+def print_search_results(query_text, result):
+    """Print the vectors found for query_text (or the exception raised while searching)."""
     print(f"\n🔍 Searching for: '{query_text}'")
     print("-" * 50)
     
-    try:
-        # Get embedding for query
-        query_embedding = get_embedding(query_text)
-        
-        # Search S3 Vectors
-        response = s3_vectors.query_vectors(
-            vectorBucketName=VECTOR_BUCKET,
-            indexName=INDEX_NAME,
-            queryVector={"float32": query_embedding},
-            topK=k,
-            returnDistance=True,
-            returnMetadata=True
-        )
+    if isinstance(result, Exception):
+        print(f"❌ Error searching: {result}")
+        return
+    
+    vectors = result
+    print(f"Found {len(vectors)} results:\n")
+    
+    for i, vector in enumerate(vectors, 1):
+        metadata = vector.get('metadata', {})
+        distance = vector.get('distance', 0)
+        similarity = 1 - distance  # Convert distance to similarity score
         
-        vectors = response.get('vectors', [])
-        print(f"Found {len(vectors)} results:\n")
+        print(f"{i}. 📊 Similarity: {similarity:.3f}")
+        if metadata.get('title'):
+            print(f"   📝 Title: {metadata['title']}")
+        if metadata.get('character'):
+            print(f"   👤 Character: {metadata['character']}")
+        if metadata.get('movie'):
+            print(f"   🎬 Movie: {metadata['movie']}")
+        if metadata.get('category'):
+            print(f"   📂 Category: {metadata['category']}")
         
-        for i, vector in enumerate(vectors, 1):
+        # Show text preview
+        text = metadata.get('text', '')
+        preview = text[:150] + '...' if len(text) > 150 else text
+        print(f"   📖 Text: {preview}")
+        print()
+
+def print_character_results(character_name, k, result):
+    """Print (exact_matches, semantic_results) for a character (or the exception raised)."""
+    print(f"\n👤 Character Search: '{character_name}'")
+    print("-" * 50)
+    
+    if isinstance(result, Exception):
+        print(f"❌ Error in character search: {result}")
+        return
+    
+    exact_matches, vectors = result
+    if exact_matches:
+        print(f"Found {len(exact_matches)} documents about {character_name}:\n")
+        for i, vector in enumerate(exact_matches, 1):
             metadata = vector.get('metadata', {})
-            distance = vector.get('distance', 0)
-            similarity = 1 - distance  # Convert distance to similarity score
+            similarity = 1 - vector.get('distance', 0)
             
             print(f"{i}. 📊 Similarity: {similarity:.3f}")
-            if metadata.get('title'):
-                print(f"   📝 Title: {metadata['title']}")
-            if metadata.get('character'):
-                print(f"   👤 Character: {metadata['character']}")
-            if metadata.get('movie'):
-                print(f"   🎬 Movie: {metadata['movie']}")
-            if metadata.get('category'):
-                print(f"   📂 Category: {metadata['category']}")
-            
-            # Show text preview
-            text = metadata.get('text', '')
-            preview = text[:150] + '...' if len(text) > 150 else text
-            print(f"   📖 Text: {preview}")
+            print(f"   📝 {metadata.get('title', 'Unknown')}")
+            print(f"   🎬 {metadata.get('movie', 'Unknown')}")
+            print(f"   📖 {metadata.get('text', '')[:200]}...")
             print()
-            
+    else:
+        print(f"No exact matches for '{character_name}'. Showing semantic results:\n")
+        for i, vector in enumerate(vectors[:k], 1):
+            metadata = vector.get('metadata', {})
+            similarity = 1 - vector.get('distance', 0)
+            print(f"{i}. 📊 Similarity: {similarity:.3f} - {metadata.get('character', 'Unknown')}")
+            print(f"   📝 {metadata.get('title', 'Unknown')}")
+            print()
+
+def search_vectors(query_text, k=5, query_embedding=None):
+    """Search for vectors by query text (or a precomputed embedding of it)."""
+    try:
+        # Get embedding for query
+        if query_embedding is None:
+            query_embedding = get_embedding(query_text)
+        
+        # Search S3 Vectors
+        response = s3_vectors.query_vectors(**_query_params(query_embedding, k))
+        result = response.get('vectors', [])
     except Exception as e:
-        print(f"❌ Error searching: {e}")
+        result = e
+    print_search_results(query_text, result)
 
-def search_by_character(character_name, k=3):
+def search_by_character(character_name, k=3, query_embedding=None):
     """Search for content about a specific character."""
-    print(f"\n👤 Character Search: '{character_name}'")
-    print("-" * 50)
-    
     try:
         # Get embedding for character query
-        query_embedding = get_embedding(f"{character_name} character profile personality")
-        
-        response = s3_vectors.query_vectors(
-            vectorBucketName=VECTOR_BUCKET,
-            indexName=INDEX_NAME,
-            queryVector={"float32": query_embedding},
-            topK=10,  # Get more results to filter
-            returnDistance=True,
-            returnMetadata=True
-        )
-        
-        vectors = response.get('vectors', [])
-        
-        # Filter for exact character matches first
-        character_lower = character_name.lower()
-        exact_matches = [v for v in vectors if character_lower in v.get('metadata', {}).get('character', '').lower()]
+        if query_embedding is None:
+            query_embedding = get_embedding(character_query(character_name))
         
-        if exact_matches:
-            print(f"Found {len(exact_matches)} documents about {character_name}:\n")
-            for i, vector in enumerate(exact_matches[:k], 1):
-                metadata = vector.get('metadata', {})
-                similarity = 1 - vector.get('distance', 0)
-                
-                print(f"{i}. 📊 Similarity: {similarity:.3f}")
-                print(f"   📝 {metadata.get('title', 'Unknown')}")
-                print(f"   🎬 {metadata.get('movie', 'Unknown')}")
-                print(f"   📖 {metadata.get('text', '')[:200]}...")
-                print()
-        else:
-            print(f"No exact matches for '{character_name}'. Showing semantic results:\n")
-            for i, vector in enumerate(vectors[:k], 1):
-                metadata = vector.get('metadata', {})
-                similarity = 1 - vector.get('distance', 0)
-                print(f"{i}. 📊 Similarity: {similarity:.3f} - {metadata.get('character', 'Unknown')}")
-                print(f"   📝 {metadata.get('title', 'Unknown')}")
-                print()
-                
+        # Let S3 Vectors filter on the character metadata server-side, and
+        # fall back to an unfiltered semantic query if nothing matches
+        response = s3_vectors.query_vectors(**_query_params(query_embedding, k, character_name))
+        exact_matches = response.get('vectors', [])
+        vectors = []
+        if not exact_matches:
+            vectors = s3_vectors.query_vectors(**_query_params(query_embedding, k)).get('vectors', [])
+        result = (exact_matches, vectors)
     except Exception as e:
-        print(f"❌ Error in character search: {e}")
+        result = e
+    print_character_results(character_name, k, result)
+
+async def _search_vectors_async(s3v, query_embedding, k):
+    response = await s3v.query_vectors(**_query_params(query_embedding, k))
+    return response.get('vectors', [])
+
+async def _search_by_character_async(s3v, character_name, query_embedding, k):
+    response = await s3v.query_vectors(**_query_params(query_embedding, k, character_name))
+    exact_matches = response.get('vectors', [])
+    vectors = []
+    if not exact_matches:
+        response = await s3v.query_vectors(**_query_params(query_embedding, k))
+        vectors = response.get('vectors', [])
+    return exact_matches, vectors
+
+async def run_searches_async(query_embeddings, character_embeddings, k):
+    """Run every query concurrently on one pooled client.
+
+    query_embeddings and character_embeddings are lists of (name, embedding)
+    pairs; returns (query_results, character_results) in the same order, with
+    an exception in place of any search that failed.
+    """
+    session = aioboto3.Session()
+    async with session.client('s3vectors', config=AioConfig(**CLIENT_CONFIG)) as s3v:
+        results = await asyncio.gather(
+            *[_search_vectors_async(s3v, embedding, k) for _, embedding in query_embeddings],
+            *[_search_by_character_async(s3v, name, embedding, k) for name, embedding in character_embeddings],
+            return_exceptions=True,
+        )
+    return results[:len(query_embeddings)], results[len(query_embeddings):]
 
 def main():
     """Explore the Despicable Me knowledge base with various searches."""
@@ -147,10 +206,6 @@ def main():
     print(f"Model: {SAGEMAKER_ENDPOINT} (BGE-M3)")
     print()
     
-    # Semantic search examples
-    print("🔍 SEMANTIC SEARCH EXAMPLES")
-    print("=" * 60)
-    
     search_queries = [
         "villain with orange tracksuit and bowl cut hair",
         "stealing the moon with shrink ray technology", 
@@ -159,18 +214,48 @@ def main():
         "1980s nostalgia disco dancing former child star",
         "secret agent with lipstick weapons"
     ]
+    # The character filter is an exact $eq match, so these must be the stored
+    # metadata values
+    characters = ["Vector", "Gru", "Minions", "Lucy Wilde"]
+    
+    # Embed every query in a single SageMaker call; if that fails each
+    # search embeds its own query instead
+    all_queries = search_queries + [character_query(c) for c in characters]
+    try:
+        embeddings = get_embeddings_batch(sagemaker_runtime, SAGEMAKER_ENDPOINT, all_queries)
+    except Exception as e:
+        print(f"⚠️  Batched embedding failed ({e}); embedding queries one at a time")
+        embeddings = [None] * len(all_queries)
+    query_embeddings = list(zip(search_queries, embeddings[:len(search_queries)]))
+    character_embeddings = list(zip(characters, embeddings[len(search_queries):]))
+    
+    if aioboto3 is not None and all(e is not None for e in embeddings):
+        # Collect all results concurrently first, then print them in order
+        query_results, character_results = asyncio.run(
+            run_searches_async(query_embeddings, character_embeddings, k=2)
+        )
+    else:
+        query_results = character_results = None
     
-    for query in search_queries:
-        search_vectors(query, k=2)
+    # Semantic search examples
+    print("🔍 SEMANTIC SEARCH EXAMPLES")
+    print("=" * 60)
+    
+    for i, (query, embedding) in enumerate(query_embeddings):
+        if query_results is not None:
+            print_search_results(query, query_results[i])
+        else:
+            search_vectors(query, k=2, query_embedding=embedding)
     
     # Character-specific searches
     print("\n👤 CHARACTER-SPECIFIC SEARCHES")
     print("=" * 60)
     
-    characters = ["Vector", "Gru", "Minions", "Lucy"]
-    
-    for character in characters:
-        search_by_character(character, k=2)
+    for i, (character, embedding) in enumerate(character_embeddings):
+        if character_results is not None:
+            print_character_results(character, 2, character_results[i])
+        else:
+            search_by_character(character, k=2, query_embedding=embedding)
     
     print("\n✨ SEMANTIC SEARCH MAGIC!")
     print("Notice how BGE-M3 finds relevant content even when:")
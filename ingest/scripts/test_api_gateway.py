@@ -1,44 +1,152 @@
 """
 Test script for the API Gateway ingestion endpoint.
 Tests the full HTTP API pipeline with new Despicable Me content.
+
+When aiohttp is installed the documents are posted concurrently; otherwise
+they are sent one at a time over a pooled requests session.
 """
 
+import asyncio
 import requests
 import json
+import random
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import aiohttp
+except ImportError:  # optional; main() then posts the documents one by one
+    aiohttp = None
 
 # API Configuration
 API_ENDPOINT = "https://your_endpoint.execute-api.us-east-1.amazonaws.com/prod/ingest"
 API_KEY = "put your key here"
 
-def test_api_ingestion(content, metadata=None):
-    """Test ingesting content via API Gateway."""
-    
-    headers = {
-        'x-api-key': API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
-    payload = {
+HEADERS = {
+    'x-api-key': API_KEY,
+    'Content-Type': 'application/json'
+}
+# Concurrent POSTs in flight when posting with aiohttp
+API_CONCURRENCY = 4
+# Responses that mean the document was not ingested, so the POST is safe to
+# repeat. 500/502/504 may come after the Lambda already stored the vector, and
+# retrying the (non-idempotent) POST would store it twice. Anything else
+# (including success) returns immediately, so there is no fixed delay between requests
+RETRY_STATUSES = (429, 503)
+MAX_ATTEMPTS = 4
+# (connect, read) seconds for the requests session
+REQUEST_TIMEOUT = (3, 30)
+# Client-side limit matching the API Gateway usage plan / stage throttling
+# (steady requests per second, and burst size)
+RATE_LIMIT = 100
+BURST_LIMIT = 200
+
+# One session for every request, so they share a keep-alive connection to API
+# Gateway instead of paying a TCP + TLS handshake per document
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=MAX_ATTEMPTS - 1,
+        # Never re-send after the request went out: a read timeout or reset may
+        # mean the Lambda is still ingesting it. read=False re-raises the error
+        # itself (requests' Timeout) instead of wrapping it in MaxRetryError.
+        # Connection errors before sending are still retried.
+        read=False,
+        backoff_factor=0.25,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=['POST'],
+        respect_retry_after_header=True,
+        # hand the final 429/503 response to the caller instead of raising
+        # MaxRetryError, so its body is printed like any other response
+        raise_on_status=False
+    )
+))
+
+class TokenBucket:
+    """Token-bucket rate limiter: up to burst requests at once, refilled at rate per second.
+
+    acquire() only waits when the bucket is empty. Tokens are reserved before
+    waiting, so concurrent coroutines queue up behind each other instead of
+    all waking at the same moment.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _reserve(self):
+        """Take a token; returns how long to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+_RATE_LIMITER = TokenBucket(RATE_LIMIT, BURST_LIMIT)
+
+def _retry_after(headers):
+    """Seconds to wait from a Retry-After header, or None if absent or not a number."""
+    try:
+        return max(0.0, float(headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+def _payload(content, metadata):
+    return {
         'text': content,  # Lambda expects 'text' field
         'metadata': metadata or {}
     }
-    
+
+def _print_sending(content, metadata):
     print(f"📤 Sending to API: {metadata.get('title', 'Unknown')}")
     print(f"   Content preview: {content[:100]}...")
+
+def _print_response(status_code, text):
+    """Report an API response; returns True if the document was ingested."""
+    print(f"   📊 Status Code: {status_code}")
     
-    try:
-        response = requests.post(API_ENDPOINT, headers=headers, json=payload, timeout=30)
-        
-        print(f"   📊 Status Code: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            print(f"   ✅ Success! Document ID: {result.get('document_id', 'Unknown')}")
-            return True
-        else:
-            print(f"   ❌ Error: {response.text}")
+    if status_code == 200:
+        try:
+            document_id = json.loads(text).get('document_id', 'Unknown')
+        except (ValueError, AttributeError) as e:
+            # not a JSON object; report it like any other failed request
+            print(f"   ❌ Exception: unexpected response body ({e}): {text[:100]}")
             return False
+        print(f"   ✅ Success! Document ID: {document_id}")
+        return True
+    else:
+        print(f"   ❌ Error: {text}")
+        return False
+
+def test_api_ingestion(content, metadata=None):
+    """Test ingesting content via API Gateway."""
+    
+    payload = _payload(content, metadata)
+    
+    _print_sending(content, metadata)
+    
+    try:
+        # urllib3's Retry (mounted on SESSION) already retries 429/503, honoring Retry-After
+        _RATE_LIMITER.acquire()
+        response = SESSION.post(API_ENDPOINT, json=payload, timeout=REQUEST_TIMEOUT)
+        return _print_response(response.status_code, response.text)
             
     except requests.exceptions.Timeout:
         print(f"   ⏰ Timeout - Lambda may still be processing")
@@ -47,6 +155,57 @@ def test_api_ingestion(content, metadata=None):
         print(f"   ❌ Exception: {e}")
         return False
 
+def _backoff_delay(attempt):
+    """Exponential backoff with jitter: ~0.25s, 0.5s, 1s, ... capped at 8s."""
+    return min(8, 0.25 * (2 ** attempt)) + random.uniform(0, 0.25)
+
+async def post_one(session, semaphore, doc):
+    """POST one document, backing off only on 429/503; returns (status_code, response_text).
+
+    A Retry-After header is waited out exactly; otherwise retries use jittered
+    exponential backoff.
+    """
+    payload = _payload(doc['content'], doc['metadata'])
+    for attempt in range(MAX_ATTEMPTS):
+        async with semaphore:
+            await _RATE_LIMITER.acquire_async()
+            async with session.post(
+                API_ENDPOINT,
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                status, text = response.status, await response.text()
+                retry_after = _retry_after(response.headers) if status in RETRY_STATUSES else None
+        if status not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+            return status, text
+        # Sleep outside the semaphore so other documents keep flowing
+        await asyncio.sleep(retry_after if retry_after is not None else _backoff_delay(attempt))
+
+async def post_all(docs):
+    """POST every document concurrently (at most API_CONCURRENCY at a time).
+
+    Returns one (status_code, response_text) per document, in order, with the
+    exception in place of any request that failed.
+    """
+    semaphore = asyncio.Semaphore(API_CONCURRENCY)
+    connector = aiohttp.TCPConnector(limit=8, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+        return await asyncio.gather(
+            *(post_one(session, semaphore, doc) for doc in docs),
+            return_exceptions=True
+        )
+
+def _print_result(doc, result):
+    """Report the outcome of post_one for doc; returns True on success."""
+    _print_sending(doc['content'], doc['metadata'])
+    if isinstance(result, asyncio.TimeoutError):
+        print(f"   ⏰ Timeout - Lambda may still be processing")
+        return False
+    if isinstance(result, Exception):
+        print(f"   ❌ Exception: {result}")
+        return False
+    return _print_response(*result)
+
 def main():
     """Test API Gateway with new Despicable Me content."""
     
@@ -121,17 +280,25 @@ def main():
     successful = 0
     total = len(api_test_docs)
     
-    for i, doc in enumerate(api_test_docs, 1):
-        print(f"{i}/{total}. Testing: {doc['metadata']['title']}")
-        
-        if test_api_ingestion(doc['content'], doc['metadata']):
-            successful += 1
-        
-        print()
-        
-        # Small delay between requests to avoid rate limiting
-        if i < total:
-            time.sleep(1)
+    if aiohttp is not None:
+        # Send everything at once, then report in document order
+        results = asyncio.run(post_all(api_test_docs))
+        for i, (doc, result) in enumerate(zip(api_test_docs, results), 1):
+            print(f"{i}/{total}. Testing: {doc['metadata']['title']}")
+            
+            if _print_result(doc, result):
+                successful += 1
+            
+            print()
+    else:
+        with SESSION:
+            for i, doc in enumerate(api_test_docs, 1):
+                print(f"{i}/{total}. Testing: {doc['metadata']['title']}")
+                
+                if test_api_ingestion(doc['content'], doc['metadata']):
+                    successful += 1
+                
+                print()
     
     print("=" * 60)
     print(f"📊 API Gateway Test Results:")
@@ -4,13 +4,19 @@ This creates a knowledge base about the Despicable Me universe!
 """
 
 import os
-import json
+import sys
 import boto3
+import numpy as np
 import uuid
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from pathlib import Path
 
+# Shared helpers live alongside the Lambda handlers in ingest/
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from _hf_output import get_embeddings_batch  # noqa: E402
+
 # Load environment variables from project root
 env_path = Path(__file__).parent.parent.parent / '.env'
 load_dotenv(env_path, override=True)
@@ -24,52 +30,79 @@ if not VECTOR_BUCKET:
     print("Error: Please run Guide 3 Step 4 to save VECTOR_BUCKET to .env")
     exit(1)
 
+# Imported after load_dotenv so its SageMaker client sees the .env settings
+from _embedding import get_embedding as _get_embedding  # noqa: E402
+
 # Initialize AWS clients
 s3_vectors = boto3.client('s3vectors')
 sagemaker_runtime = boto3.client('sagemaker-runtime')
 
 def get_embedding(text):
     """Get embedding vector from SageMaker endpoint using BGE-M3."""
-    response = sagemaker_runtime.invoke_endpoint(
-        EndpointName=SAGEMAKER_ENDPOINT,
-        ContentType='application/json',
-        Body=json.dumps({'inputs': text})
-    )
-    
-    result = json.loads(response['Body'].read().decode())
-    # BGE-M3 returns nested array [[[embedding]]], extract the actual embedding
-    if isinstance(result, list) and len(result) > 0:
-        if isinstance(result[0], list) and len(result[0]) > 0:
-            if isinstance(result[0][0], list):
-                return result[0][0]  # Extract from [[[embedding]]]
-            return result[0]  # Extract from [[embedding]]
-    return result  # Return as-is if not nested
+    return np.asarray(_get_embedding(text, SAGEMAKER_ENDPOINT), dtype=np.float32)
+
+def get_embeddings(texts):
+    """Get embedding vectors for several texts with a single SageMaker call.
+
+    Returns an (N, D) float32 array, one row per text.
+    """
+    return np.asarray(get_embeddings_batch(sagemaker_runtime, SAGEMAKER_ENDPOINT, texts), dtype=np.float32)
+
+def _now_iso():
+    """Current UTC time as an ISO 8601 string (millisecond precision)."""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+
+def _vector(text, embedding, metadata=None, timestamp=None):
+    """Build an S3 Vectors record with a fresh ID from a float32 embedding array."""
+    return {
+        "key": str(uuid.uuid4()),
+        # boto3 serializes plain lists; convert once, here at the API boundary
+        "data": {"float32": embedding.tolist()},
+        "metadata": {
+            "text": text,
+            "timestamp": timestamp or _now_iso(),
+            **(metadata or {})  # Include any additional metadata
+        }
+    }
 
 def ingest_document(text, metadata=None):
     """Ingest a document directly to S3 Vectors."""
-    # Get embedding from SageMaker
-    print(f"Getting embedding for: {metadata.get('title', 'Unknown')}...")
+    # Get embedding from SageMaker (progress is reported by the caller, since
+    # this runs on worker threads)
     embedding = get_embedding(text)
     
-    # Generate unique ID for the vector
-    vector_id = str(uuid.uuid4())
-    
     # Store in S3 Vectors
+    vector = _vector(text, embedding, metadata)
     s3_vectors.put_vectors(
         vectorBucketName=VECTOR_BUCKET,
         indexName=INDEX_NAME,
-        vectors=[{
-            "key": vector_id,
-            "data": {"float32": embedding},
-            "metadata": {
-                "text": text,
-                "timestamp": datetime.datetime.utcnow().isoformat(),
-                **(metadata or {})  # Include any additional metadata
-            }
-        }]
+        vectors=[vector]
     )
     
-    return vector_id
+    return vector["key"]
+
+def process(doc):
+    """Ingest one entry of the document list; returns its vector ID."""
+    return ingest_document(doc['text'], doc['metadata'])
+
+def ingest_documents(docs):
+    """Ingest documents with one SageMaker call and one put_vectors call.
+
+    put_vectors accepts at most 500 vectors, which is plenty for this script.
+    Returns the vector IDs in document order.
+    """
+    embeddings = get_embeddings([doc['text'] for doc in docs])
+    timestamp = _now_iso()  # one timestamp for the whole batch
+    vectors = [
+        _vector(doc['text'], embedding, doc['metadata'], timestamp)
+        for doc, embedding in zip(docs, embeddings)
+    ]
+    s3_vectors.put_vectors(
+        vectorBucketName=VECTOR_BUCKET,
+        indexName=INDEX_NAME,
+        vectors=vectors
+    )
+    return [vector["key"] for vector in vectors]
 
 def main():
     """Test ingestion with Despicable Me content."""
@@ -184,18 +217,35 @@ def main():
         }
     ]
     
-    # Ingest each document
+    # Ingest all documents in one batch, falling back to one at a time
     print("Ingesting Despicable Me documents...")
     print()
     
-    for i, doc in enumerate(despicable_me_docs, 1):
-        print(f"{i:2d}. {doc['metadata']['title']}")
-        try:
-            doc_id = ingest_document(doc['text'], doc['metadata'])
-            print(f"     ✓ Success! ID: {doc_id[:8]}...")
-        except Exception as e:
-            print(f"     ✗ Error: {e}")
+    try:
+        doc_ids = ingest_documents(despicable_me_docs)
+    except Exception as e:
+        print(f"Batched ingest failed ({e}); ingesting documents one at a time")
         print()
+        doc_ids = None
+    
+    if doc_ids is not None:
+        for i, (doc, doc_id) in enumerate(zip(despicable_me_docs, doc_ids), 1):
+            print(f"{i:2d}. {doc['metadata']['title']}")
+            print(f"     ✓ Success! ID: {doc_id[:8]}...")
+            print()
+    else:
+        # The per-document calls are independent I/O, so run them on a pool;
+        # boto3 clients are thread-safe. Each result is printed in one call
+        # so the lines from different documents do not interleave.
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {executor.submit(process, doc): i for i, doc in enumerate(despicable_me_docs, 1)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    status = f"     ✓ Success! ID: {future.result()[:8]}..."
+                except Exception as e:
+                    status = f"     ✗ Error: {e}"
+                print(f"{i:2d}. {despicable_me_docs[i - 1]['metadata']['title']}\n{status}\n")
     
     print("🎉 Despicable Me Knowledge Base Created!")
     print("\nYour S3 Vectors database now contains:")
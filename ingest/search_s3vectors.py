@@ -2,16 +2,22 @@
 Lambda function for searching S3 Vectors.
 """
 
-import json
 import os
-import time
+import socket
+from urllib.parse import urlparse
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from _embedding import CircuitOpenError, get_embedding, sagemaker_runtime
+from _hf_output import dumps, loads
+
 # Environment variables
 VECTOR_BUCKET = os.environ.get('VECTOR_BUCKET', 'my-despicable-bucket12212025')
 SAGEMAKER_ENDPOINT = os.environ.get('SAGEMAKER_ENDPOINT')
 INDEX_NAME = os.environ.get('INDEX_NAME', 'despme-index')
+# Longer queries are rejected before any SageMaker call
+MAX_QUERY_CHARS = 8192
 
 # Validate environment variables at startup (fail early with clear message)
 if not SAGEMAKER_ENDPOINT:
@@ -21,49 +27,37 @@ if not VECTOR_BUCKET:
 if not INDEX_NAME:
     raise RuntimeError("INDEX_NAME is not set; set it in Lambda env or .env")
 
-# Initialize AWS clients
-sagemaker_runtime = boto3.client('sagemaker-runtime')
-s3_vectors = boto3.client('s3vectors')
+# Initialize AWS clients. Clients live at module scope so warm invocations reuse
+# their pooled keep-alive connections. The SageMaker client, retries, circuit
+# breaker and query-embedding cache live in _embedding.
+s3_vectors = boto3.client('s3vectors', config=Config(
+    max_pool_connections=20,
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=30,
+    retries={'mode': 'standard'},
+))
 
 
-def get_embedding(text):
-    """Get embedding vector from SageMaker endpoint with retries and error handling."""
-    attempts = 3
-    delay = 1
-    for attempt in range(attempts):
+def _warm_dns(*clients):
+    """Resolve the clients' endpoint hostnames so the first request skips the DNS lookup."""
+    for client in clients:
+        host = urlparse(client.meta.endpoint_url).hostname
         try:
-            response = sagemaker_runtime.invoke_endpoint(
-                EndpointName=SAGEMAKER_ENDPOINT,
-                ContentType='application/json',
-                Body=json.dumps({'inputs': text})
-            )
+            socket.getaddrinfo(host, 443, type=socket.SOCK_STREAM)
+        except (OSError, UnicodeError) as e:
+            # Only an optimization; the request itself will resolve (or fail) normally
+            print(f"DNS pre-resolution failed for {host}: {e}")
+
 
-            result = json.loads(response['Body'].read().decode())
-            # HuggingFace returns nested array [[[embedding]]], extract the actual embedding
-            embedding = None
-            if isinstance(result, list) and len(result) > 0:
-                if isinstance(result[0], list) and len(result[0]) > 0:
-                    if isinstance(result[0][0], list):
-                        embedding = result[0][0]  # Extract from [[[embedding]]]
-                    else:
-                        embedding = result[0]  # Extract from [[embedding]]
-            else:
-                embedding = result  # Return as-is if not nested
+# Runs once per container, during the cold start's init phase
+_warm_dns(sagemaker_runtime, s3_vectors)
 
-            return embedding
 
-        except ClientError as e:
-            code = e.response.get('Error', {}).get('Code')
-            print(f"ClientError calling SageMaker invoke_endpoint: {code} - {e}")
-            # Retry on transient errors
-            if attempt < attempts - 1:
-                time.sleep(delay)
-                delay *= 2
-                continue
-            raise
-        except Exception as e:
-            print(f"Unexpected error calling SageMaker: {e}")
-            raise
+def _dumps(obj):
+    """Serialize a response body; API Gateway needs a str, orjson returns bytes."""
+    body = dumps(obj)
+    return body.decode() if isinstance(body, bytes) else body
 
 
 def lambda_handler(event, context):
@@ -77,7 +71,7 @@ def lambda_handler(event, context):
     """
     # Parse the request body
     if isinstance(event.get('body'), str):
-        body = json.loads(event['body'])
+        body = loads(event['body'])
     else:
         body = event.get('body', {})
     
@@ -87,28 +81,39 @@ def lambda_handler(event, context):
     if not query_text:
         return {
             'statusCode': 400,
-            'body': json.dumps({'error': 'Missing required field: query'})
+            'body': _dumps({'error': 'Missing required field: query'})
+        }
+    
+    if not isinstance(query_text, str):
+        return {
+            'statusCode': 400,
+            'body': _dumps({'error': 'Field query must be a string'})
+        }
+    if len(query_text) > MAX_QUERY_CHARS:
+        return {
+            'statusCode': 413,
+            'body': _dumps({'error': 'query too long'})
         }
     
-    # Get embedding for query
-    print(f"Getting embedding for query: {query_text}")
-    query_embedding = get_embedding(query_text)
-
     # Validate k (must be int between 1 and 50)
     try:
-        k = int(k)
+        k = min(max(int(k), 1), 50)
     except Exception:
         k = 5
-    if k <= 0:
-        k = 5
-    if k > 50:
-        k = 50
-
-    # Validate embedding
-    if not isinstance(query_embedding, list) or len(query_embedding) == 0:
+    
+    # Get embedding for query
+    print(f"Getting embedding for query: {query_text}")
+    try:
+        query_embedding = get_embedding(query_text, SAGEMAKER_ENDPOINT)
+    except CircuitOpenError:
+        return {
+            'statusCode': 503,
+            'body': _dumps({'error': 'embedding service temporarily unavailable'})
+        }
+    except ValueError:
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': 'Invalid embedding returned from SageMaker'})
+            'body': _dumps({'error': 'Invalid embedding returned from SageMaker'})
         }
 
     # Search S3 Vectors
@@ -117,7 +122,7 @@ def lambda_handler(event, context):
         response = s3_vectors.query_vectors(
             vectorBucketName=VECTOR_BUCKET,
             indexName=INDEX_NAME,
-            queryVector={"float32": query_embedding},
+            queryVector={"float32": list(query_embedding)},
             topK=k,
             returnDistance=True,
             returnMetadata=True
@@ -128,28 +133,32 @@ def lambda_handler(event, context):
         if code == 'NotFoundException':
             return {
                 'statusCode': 404,
-                'body': json.dumps({'error': f"Index '{INDEX_NAME}' not found in bucket '{VECTOR_BUCKET}'"})
+                'body': _dumps({'error': f"Index '{INDEX_NAME}' not found in bucket '{VECTOR_BUCKET}'"})
             }
         if code in ('AccessDeniedException', 'AccessDenied'):
             return {
                 'statusCode': 403,
-                'body': json.dumps({'error': 'Access denied. Ensure IAM role has s3vectors:* permissions'})
+                'body': _dumps({'error': 'Access denied. Ensure IAM role has s3vectors:* permissions'})
             }
         raise
     
-    # Format results
-    results = []
-    for vector in response.get('vectors', []):
-        results.append({
+    # Format results (metadata is looked up once per vector)
+    results = [
+        {
             'id': vector['key'],
             'score': vector.get('distance', 0),
-            'text': vector.get('metadata', {}).get('text', ''),
-            'metadata': vector.get('metadata', {})
-        })
+            'text': (metadata := vector.get('metadata', {})).get('text', ''),
+            'metadata': metadata
+        }
+        for vector in response.get('vectors', [])
+    ]
     
     return {
         'statusCode': 200,
-        'body': json.dumps({
+        # Identical queries return identical results for a while; let clients
+        # and caches in front of API Gateway reuse them
+        'headers': {'Cache-Control': 'max-age=300'},
+        'body': _dumps({
             'results': results,
             'count': len(results)
         })
@@ -0,0 +1,68 @@
+"""
+Tests for the retry policy of the requests session in scripts/test_api_gateway.
+
+Run from the repository root with: python -m unittest discover -s ingest/tests
+"""
+
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+try:
+    import test_api_gateway as api  # noqa: E402
+except ImportError:  # requests is not installed
+    api = None
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    """Answers every POST after longer than the client's read timeout."""
+
+    protocol_version = 'HTTP/1.1'
+    posts = 0
+
+    def do_POST(self):
+        type(self).posts += 1
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(0.5)
+        body = b'{"document_id": "late"}'
+        try:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:  # the client gave up already
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipIf(api is None, "requests is not installed")
+class ReadTimeoutTests(unittest.TestCase):
+    def setUp(self):
+        _SlowHandler.posts = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        # SESSION only mounts the retrying adapter for https://
+        api.SESSION.mount('http://', api.SESSION.get_adapter('https://'))
+        self.addCleanup(api.SESSION.adapters.pop, 'http://')
+
+    def test_read_timeout_is_not_resent(self):
+        url = f'http://127.0.0.1:{self.server.server_port}/ingest'
+        with mock.patch.object(api, 'API_ENDPOINT', url), \
+                mock.patch.object(api, 'REQUEST_TIMEOUT', (3, 0.1)), \
+                mock.patch('builtins.print') as printed:
+            self.assertFalse(api.test_api_ingestion('text', {'title': 'slow'}))
+        self.assertEqual(_SlowHandler.posts, 1)
+        printed.assert_any_call("   ⏰ Timeout - Lambda may still be processing")
+
+
+if __name__ == '__main__':
+    unittest.main()
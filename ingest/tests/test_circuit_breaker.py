@@ -0,0 +1,100 @@
+"""
+Unit tests for the CircuitBreaker in _embedding.
+
+Run from the repository root with: python -m unittest discover -s ingest/tests
+"""
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+# _embedding creates its boto3 client at import, which needs a region
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+try:
+    import _embedding  # noqa: E402
+except ImportError:  # boto3 is not installed
+    _embedding = None
+
+
+class Unhealthy(Exception):
+    pass
+
+
+class BadInput(Exception):
+    pass
+
+
+def _fail(error):
+    raise error
+
+
+@unittest.skipIf(_embedding is None, "boto3 is not installed")
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(_embedding.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = _embedding.CircuitBreaker(
+            fail_threshold=3,
+            reset_timeout=30,
+            is_failure=lambda error: isinstance(error, Unhealthy),
+        )
+
+    def trip(self):
+        for _ in range(self.breaker.fail_threshold):
+            with self.assertRaises(Unhealthy):
+                self.breaker.call(_fail, Unhealthy())
+
+    def test_opens_after_fail_threshold_failures(self):
+        for _ in range(self.breaker.fail_threshold - 1):
+            with self.assertRaises(Unhealthy):
+                self.breaker.call(_fail, Unhealthy())
+        self.assertEqual(self.breaker.state, 'closed')
+        with self.assertRaises(Unhealthy):
+            self.breaker.call(_fail, Unhealthy())
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_fails_fast_while_open(self):
+        self.trip()
+        dependency = mock.Mock(return_value='ok')
+        self.now += 29
+        with self.assertRaises(_embedding.CircuitOpenError):
+            self.breaker.call(dependency)
+        dependency.assert_not_called()
+
+    def test_successful_half_open_probe_closes(self):
+        self.trip()
+        self.now += 30
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.fail_count, 0)
+
+    def test_failed_half_open_probe_reopens(self):
+        self.trip()
+        self.now += 30
+        with self.assertRaises(Unhealthy):
+            self.breaker.call(_fail, Unhealthy())
+        self.assertEqual(self.breaker.state, 'open')
+        # the reset timeout starts again from the failed probe
+        self.now += 29
+        with self.assertRaises(_embedding.CircuitOpenError):
+            self.breaker.call(lambda: 'ok')
+
+    def test_non_failure_resets_count(self):
+        for _ in range(self.breaker.fail_threshold - 1):
+            with self.assertRaises(Unhealthy):
+                self.breaker.call(_fail, Unhealthy())
+        with self.assertRaises(BadInput):
+            self.breaker.call(_fail, BadInput())
+        self.assertEqual(self.breaker.fail_count, 0)
+        with self.assertRaises(Unhealthy):
+            self.breaker.call(_fail, Unhealthy())
+        self.assertEqual(self.breaker.state, 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()
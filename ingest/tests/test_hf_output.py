@@ -0,0 +1,71 @@
+"""
+Unit tests for the embedding-output extractors in _hf_output.
+
+Run from the repository root with: python -m unittest discover -s ingest/tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import _hf_output  # noqa: E402
+
+
+def _reset_learned_depths():
+    # The learned depths are module state; start every shape unlearned
+    _hf_output._single_depth = None
+    _hf_output._row_depth = None
+
+
+class ExtractorTestCase(unittest.TestCase):
+    def setUp(self):
+        _reset_learned_depths()
+
+
+class ExtractEmbeddingTests(ExtractorTestCase):
+    def test_single_shapes(self):
+        for result in ([0.1, 0.2], [[0.1, 0.2]], [[[0.1, 0.2]]]):
+            with self.subTest(result=result):
+                _reset_learned_depths()
+                self.assertEqual(_hf_output.extract_embedding(result), [0.1, 0.2])
+
+    def test_token_matrix_returns_first_token(self):
+        result = [[[0.1, 0.2], [0.3, 0.4]]]
+        self.assertEqual(_hf_output.extract_embedding(result), [0.1, 0.2])
+
+    def test_empty_result_is_not_learned(self):
+        self.assertEqual(_hf_output.extract_embedding([]), [])
+        self.assertEqual(_hf_output.extract_embedding([[[0.1, 0.2]]]), [0.1, 0.2])
+
+
+class ExtractEmbeddingsTests(ExtractorTestCase):
+    def test_batched_shapes(self):
+        for result in (
+            [[0.1, 0.2], [0.3, 0.4]],
+            [[[0.1, 0.2]], [[0.3, 0.4]]],
+            [[[[0.1, 0.2]]], [[[0.3, 0.4]]]],
+        ):
+            with self.subTest(result=result):
+                _reset_learned_depths()
+                self.assertEqual(_hf_output.extract_embeddings(result, 2), [[0.1, 0.2], [0.3, 0.4]])
+
+    def test_batched_token_matrices_return_first_token_per_row(self):
+        result = [
+            [[[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]]],
+            [[[0.7, 0.8, 0.9], [1.0, 1.1, 1.2]]],
+        ]
+        self.assertEqual(_hf_output.extract_embeddings(result, 2), [[0.1, 0.2, 0.3], [0.7, 0.8, 0.9]])
+
+    def test_row_count_mismatch(self):
+        self.assertIsNone(_hf_output.extract_embeddings([[[0.1, 0.2]]], 2))
+
+    def test_single_and_batched_depths_are_independent(self):
+        self.assertEqual(_hf_output.extract_embeddings([[1.0, 2.0], [3.0, 4.0]], 2), [[1.0, 2.0], [3.0, 4.0]])
+        self.assertEqual(_hf_output.extract_embedding([1.0, 2.0]), [1.0, 2.0])
+        self.assertEqual(_hf_output.extract_embedding([5.0, 6.0]), [5.0, 6.0])
+        self.assertEqual(_hf_output.extract_embeddings([[7.0, 8.0]], 1), [[7.0, 8.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()